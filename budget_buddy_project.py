@@ -1,55 +1,243 @@
 import os
+import re
 from datetime import datetime
-from flask import Flask, render_template, jsonify, request
-from pymongo import MongoClient
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+import orjson
+import redis
+from flask import Flask, Response, g, render_template, request
+from pymongo import MongoClient, WriteConcern
+from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
-from bson.errors import InvalidId
 from dotenv import load_dotenv
 from urllib.parse import urlparse
 
 load_dotenv()
 
 app = Flask(__name__)
+# Caps request bodies (bulk imports are the largest) before JSON parsing
+app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
 
 MONGODB_URI = os.environ.get("MONGODB_URI")
 if not MONGODB_URI:
     raise RuntimeError("MONGODB_URI not set")
 
-client = MongoClient(MONGODB_URI)
-
 # Safe debug prints (no secrets)
-uri = os.environ.get("MONGODB_URI") or os.environ.get("MONGO_URI") or ""
-p = urlparse(uri)
-print("MONGO scheme:", p.scheme)
-print("MONGO host:", p.hostname)
-print("MONGO db:", p.path)
-print("MONGO has_user:", bool(p.username))
-print("MONGO has_pass:", p.password is not None)
-print("MONGO query:", p.query)
+if os.environ.get("DEBUG"):
+    uri = os.environ.get("MONGODB_URI") or os.environ.get("MONGO_URI") or ""
+    p = urlparse(uri)
+    print("MONGO scheme:", p.scheme)
+    print("MONGO host:", p.hostname)
+    print("MONGO db:", p.path)
+    print("MONGO has_user:", bool(p.username))
+    print("MONGO has_pass:", p.password is not None)
+    print("MONGO query:", p.query)
+
+
+def connect():
+    global client, db, expenses_col, expenses_delete_col, settings_col
+    client = MongoClient(
+        MONGODB_URI,
+        maxPoolSize=50,
+        minPoolSize=5,
+        compressors="zstd,zlib",
+        retryWrites=True,
+        serverSelectionTimeoutMS=2000,
+        appname="budget-buddy",
+    )
+    db = client["budget-buddy-db"]
+
+    expenses_col = db["expenses"]
+    settings_col = db["settings"]
+
+    # Expense deletes are idempotent: ack from the primary without waiting on the journal
+    expenses_delete_col = expenses_col.with_options(write_concern=WriteConcern(w=1, j=False))
+
+
+connect()
+# Gunicorn forks workers after import; give each worker its own client and pool
+os.register_at_fork(after_in_child=connect)
+
+CENT = Decimal("0.01")
+# Cents are stored as BSON int64; anything outside this range fails at insert
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+# createdAt on the wire matches naive datetime.isoformat(): no zone suffix,
+# microseconds (BSON stores milliseconds) and no fraction when they are zero
+ISO_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+ISO_DATE_FORMAT_MS = "%Y-%m-%dT%H:%M:%S.%L000"
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BULK_SIZE = 1000
+
+# Pre-encoded response for users who have never saved settings
+EMPTY_SETTINGS = b'{"paycheck":0,"savingsPercent":0}'
+
+# ObjectIds increase with insertion time, so _id order is newest-first order
+EXPENSES_INDEX = [("userId", 1), ("_id", -1)]
+SUMMARY_INDEX = [("userId", 1), ("category", 1), ("amountCents", 1)]
+
+_indexes_ready = False
+
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+
+    # Serves the userId match, newest-first sort and before-cursor in get_expenses
+    expenses_col.create_index(EXPENSES_INDEX, background=True)
+    # Covers the summary pipeline so $group never fetches full documents
+    expenses_col.create_index(SUMMARY_INDEX)
+    # One settings doc per user; find_one/update_one by userId become a single seek
+    settings_col.create_index([("userId", 1)], unique=True)
+    _indexes_ready = True
+
+
+ensure_indexes()
+
+
+# /api/expenses/summary bodies are cached in Redis so every gunicorn worker sees
+# the same invalidations. Without REDIS_URL the summary is always aggregated.
+# The cache is optional: any Redis error falls through to the uncached path.
+REDIS_URL = os.environ.get("REDIS_URL")
+summary_cache = (
+    redis.Redis.from_url(REDIS_URL, socket_timeout=0.2, socket_connect_timeout=0.2)
+    if REDIS_URL
+    else None
+)
+SUMMARY_TTL_SECONDS = 30
+# Generation counters outlive many body TTLs but not forever, so Redis holds
+# one per recently active user rather than one per user ever seen
+SUMMARY_GEN_TTL_SECONDS = 24 * 60 * 60
 
-db = client["budget-buddy-db"]
 
-expenses_col = db["expenses"]
-settings_col = db["settings"]
+def _summary_keys(user_id):
+    return f"summary:{user_id}", f"summary-gen:{user_id}"
+
+
+def get_cached_summary(user_id):
+    # Returns (body, generation); body is None on a miss or when Redis is unavailable
+    if summary_cache is None:
+        return None, None
+    body_key, gen_key = _summary_keys(user_id)
+    try:
+        with summary_cache.pipeline(transaction=False) as pipe:
+            pipe.get(body_key)
+            pipe.get(gen_key)
+            body, generation = pipe.execute()
+    except redis.RedisError:
+        app.logger.warning("Summary cache read failed", exc_info=True)
+        return None, None
+    return body, generation
+
+
+def store_summary(user_id, generation, body):
+    # Only cache if no write bumped the generation since it was read
+    if summary_cache is None:
+        return
+    body_key, gen_key = _summary_keys(user_id)
+    try:
+        with summary_cache.pipeline() as pipe:
+            pipe.watch(gen_key)
+            if pipe.get(gen_key) != generation:
+                return
+            pipe.multi()
+            pipe.set(body_key, body, ex=SUMMARY_TTL_SECONDS)
+            pipe.execute()
+    except redis.WatchError:
+        pass
+    except redis.RedisError:
+        app.logger.warning("Summary cache write failed", exc_info=True)
+
+
+def invalidate_summary(user_id):
+    # Called after the Mongo write has committed, so a Redis failure must not
+    # fail the request; a missed invalidation is bounded by SUMMARY_TTL_SECONDS
+    if summary_cache is None:
+        return
+    body_key, gen_key = _summary_keys(user_id)
+    try:
+        with summary_cache.pipeline() as pipe:
+            pipe.incr(gen_key)
+            pipe.expire(gen_key, SUMMARY_GEN_TTL_SECONDS)
+            pipe.delete(body_key)
+            pipe.execute()
+    except redis.RedisError:
+        app.logger.warning("Summary cache invalidation failed", exc_info=True)
 
 
 def get_user_id():
     # NOTE: This is demo-level "auth". Any client can spoof this header.
-    return request.headers.get("X-User-Id")
+    # Same key request.headers["X-User-Id"] resolves to, without the EnvironHeaders wrapper
+    return request.environ.get("HTTP_X_USER_ID")
+
+
+@app.before_request
+def load_user_id():
+    if not request.path.startswith("/api/"):
+        return None
+    g.user_id = get_user_id()
+    if not g.user_id:
+        return ojson({"error": "Missing X-User-Id header"}, 401)
+    return None
 
 
 def require_user_id():
-    user_id = get_user_id()
-    if not user_id:
-        return None, (jsonify({"error": "Missing X-User-Id header"}), 401)
-    return user_id, None
+    return g.user_id, None
+
+
+def _encode_bson(obj):
+    # orjson handles datetime natively; ObjectId is the only BSON type we emit
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+
+def ojson(obj, status=200):
+    body = orjson.dumps(obj, default=_encode_bson, option=orjson.OPT_NAIVE_UTC)
+    return Response(body, status=status, mimetype="application/json")
+
+
+_is_object_id_hex = re.compile(r"[0-9a-fA-F]{24}").fullmatch
+
+
+@lru_cache(maxsize=1024)
+def _object_id(value: str):
+    return ObjectId(value)
 
 
 def parse_object_id(value: str):
+    # Reject junk with a regex before it reaches the ObjectId constructor (or the cache)
+    if not isinstance(value, str) or not _is_object_id_hex(value):
+        return None, ojson({"error": "Invalid id"}, 400)
+    return _object_id(value), None
+
+
+def _int64_or_none(cents: int):
+    return cents if INT64_MIN <= cents <= INT64_MAX else None
+
+
+def parse_cents(value):
+    # Exact dollars -> integer cents; None if value is not a finite number or overflows int64
+    if type(value) is int:
+        return _int64_or_none(value * 100)
     try:
-        return ObjectId(value), None
-    except (InvalidId, TypeError):
-        return None, (jsonify({"error": "Invalid id"}), 400)
+        amount = Decimal(str(value))
+        if not amount.is_finite():
+            return None
+        return _int64_or_none(int(amount.quantize(CENT) * 100))
+    except InvalidOperation:
+        return None
+
+
+def parse_amount_cents(data: dict):
+    if "amountCents" in data:
+        cents = data["amountCents"]
+        return _int64_or_none(cents) if type(cents) is int else None
+    return parse_cents(data.get("amount"))
 
 
 @app.route("/")
@@ -61,26 +249,81 @@ def home():
 # Expenses (scoped per user)
 # -------------------------
 
-# Get all expenses for the current user
+# Get a page of expenses for the current user, newest first
+# (?limit=N, ?before=<id of the last expense on the previous page>).
+# There is no next-cursor or has-more field: a page shorter than the effective
+# limit (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE) is the last one;
+# a full page means the client should ask again with before=<its last id>.
 @app.route("/api/expenses", methods=["GET"])
 def get_expenses():
     user_id, err = require_user_id()
     if err:
         return err
 
-    docs = list(expenses_col.find({"userId": user_id}).sort("createdAt", -1))
-    out = []
-    for d in docs:
-        out.append(
-            {
-                "id": str(d["_id"]),
-                "category": d.get("category"),
-                "description": d.get("description"),
-                "amount": (d.get("amountCents", 0) / 100.0),
-                "createdAt": d.get("createdAt").isoformat() if d.get("createdAt") else None,
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return ojson({"error": "Invalid limit"}, 400)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    match = {"userId": user_id}
+    before = request.args.get("before")
+    if before:
+        before_oid, oid_err = parse_object_id(before)
+        if oid_err:
+            return oid_err
+        match["_id"] = {"$lt": before_oid}
+
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"_id": -1}},
+        {"$limit": limit},
+        {
+            "$project": {
+                "_id": 0,
+                "id": {"$toString": "$_id"},
+                "category": 1,
+                "description": 1,
+                "amount": {"$divide": [{"$ifNull": ["$amountCents", 0]}, 100]},
+                "createdAt": {
+                    "$cond": [
+                        {"$eq": [{"$millisecond": "$createdAt"}, 0]},
+                        {"$dateToString": {"format": ISO_DATE_FORMAT, "date": "$createdAt"}},
+                        {"$dateToString": {"format": ISO_DATE_FORMAT_MS, "date": "$createdAt"}},
+                    ]
+                },
             }
-        )
-    return jsonify(out)
+        },
+    ]
+    # A page is at most MAX_PAGE_SIZE docs: fetch it in one batch and encode it whole,
+    # so a cursor error surfaces as a 500 instead of a truncated 200 body
+    docs = list(expenses_col.aggregate(pipeline, hint=EXPENSES_INDEX, batchSize=limit))
+    return ojson(docs)
+
+
+def build_expense(user_id, data: dict, created_at: datetime):
+    category = data.get("category") or "Other"
+    description = data.get("description") or ""
+    if not isinstance(category, str) or not isinstance(description, str):
+        return None, "Category and description must be strings"
+    category = category.strip()
+    description = description.strip()
+
+    amount_cents = parse_amount_cents(data)
+    if amount_cents is None:
+        return None, "Invalid amount"
+
+    if not description or amount_cents <= 0:
+        return None, "Description required and amount must be > 0"
+
+    doc = {
+        "userId": user_id,
+        "category": category,
+        "description": description,
+        "amountCents": amount_cents,
+        "createdAt": created_at,
+    }
+    return doc, None
 
 
 # Add an expense (owned by the current user)
@@ -92,27 +335,57 @@ def add_expense():
 
     data = request.get_json() or {}
 
-    category = (data.get("category") or "Other").strip()
-    description = (data.get("description") or "").strip()
+    doc, error = build_expense(user_id, data, datetime.utcnow())
+    if error:
+        return ojson({"error": error}, 400)
 
-    try:
-        amount = float(data.get("amount"))
-    except (TypeError, ValueError):
-        return jsonify({"error": "Invalid amount"}), 400
+    res = expenses_col.insert_one(doc)
+    invalidate_summary(user_id)
+    return ojson({"id": str(res.inserted_id)}, 201)
 
-    if not description or amount <= 0:
-        return jsonify({"error": "Description required and amount must be > 0"}), 400
 
-    doc = {
-        "userId": user_id,
-        "category": category,
-        "description": description,
-        "amountCents": int(round(amount * 100)),
-        "createdAt": datetime.utcnow(),
-    }
+# Add many expenses in one round-trip (e.g. imports)
+@app.route("/api/expenses/bulk", methods=["POST"])
+def add_expenses_bulk():
+    user_id, err = require_user_id()
+    if err:
+        return err
 
-    res = expenses_col.insert_one(doc)
-    return jsonify({"id": str(res.inserted_id)}), 201
+    data = request.get_json()
+    if not isinstance(data, list) or not data:
+        return ojson({"error": "Expected a non-empty array of expenses"}, 400)
+    if len(data) > MAX_BULK_SIZE:
+        return ojson({"error": f"At most {MAX_BULK_SIZE} expenses per request"}, 400)
+
+    # Validate everything up front so an invalid record fails the request before any insert
+    created_at = datetime.utcnow()
+    docs = []
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            return ojson({"error": "Invalid expense", "index": i}, 400)
+        doc, error = build_expense(user_id, item, created_at)
+        if error:
+            return ojson({"error": error, "index": i}, 400)
+        docs.append(doc)
+
+    try:
+        res = expenses_col.insert_many(docs, ordered=False, bypass_document_validation=True)
+    except BulkWriteError as e:
+        # Unordered inserts keep going past a failed record, so some rows may have landed
+        invalidate_summary(user_id)
+        write_errors = e.details.get("writeErrors", [])
+        failed = {we["index"] for we in write_errors}
+        return ojson(
+            {
+                "error": "Some expenses could not be inserted",
+                "inserted": e.details.get("nInserted", 0),
+                "ids": [str(d["_id"]) for i, d in enumerate(docs) if i not in failed],
+                "writeErrors": [{"index": we["index"], "error": we.get("errmsg")} for we in write_errors],
+            },
+            500,
+        )
+    invalidate_summary(user_id)
+    return ojson({"ids": [str(oid) for oid in res.inserted_ids]}, 201)
 
 
 # Delete an expense by id (must belong to current user)
@@ -126,10 +399,11 @@ def delete_expense(expense_id):
     if oid_err:
         return oid_err
 
-    res = expenses_col.delete_one({"_id": oid, "userId": user_id})
+    res = expenses_delete_col.delete_one({"_id": oid, "userId": user_id})
     if res.deleted_count == 0:
-        return jsonify({"error": "Not found"}), 404
-    return jsonify({"deleted": expense_id})
+        return ojson({"error": "Not found"}, 404)
+    invalidate_summary(user_id)
+    return ojson({"deleted": expense_id})
 
 
 # Chart summary: totals by category (current user only)
@@ -139,14 +413,21 @@ def expenses_summary():
     if err:
         return err
 
+    body, generation = get_cached_summary(user_id)
+    if body is not None:
+        return Response(body, mimetype="application/json")
+
     pipeline = [
         {"$match": {"userId": user_id}},
+        {"$project": {"_id": 0, "category": 1, "amountCents": 1}},
         {"$group": {"_id": "$category", "totalCents": {"$sum": "$amountCents"}}},
         {"$sort": {"totalCents": -1}},
     ]
-    agg = list(expenses_col.aggregate(pipeline))
+    agg = list(expenses_col.aggregate(pipeline, hint=SUMMARY_INDEX))
     result = [{"category": r["_id"], "total": r["totalCents"] / 100.0} for r in agg]
-    return jsonify(result)
+    body = orjson.dumps(result)
+    store_summary(user_id, generation, body)
+    return Response(body, mimetype="application/json")
 
 
 # -------------------------
@@ -161,17 +442,19 @@ def save_settings():
 
     data = request.get_json() or {}
 
+    paycheck_cents = parse_cents(data.get("paycheck", 0))
     try:
-        paycheck = float(data.get("paycheck", 0))
         savings_percent = float(data.get("savingsPercent", 0))
     except (TypeError, ValueError):
-        return jsonify({"error": "Invalid settings values"}), 400
+        savings_percent = None
+    if paycheck_cents is None or savings_percent is None:
+        return ojson({"error": "Invalid settings values"}, 400)
 
     settings_col.update_one(
         {"userId": user_id},
         {
             "$set": {
-                "paycheckCents": int(round(paycheck * 100)),
+                "paycheckCents": paycheck_cents,
                 "savingsPercent": savings_percent,
                 "updatedAt": datetime.utcnow(),
             }
@@ -179,7 +462,7 @@ def save_settings():
         upsert=True,
     )
 
-    return jsonify({"ok": True})
+    return ojson({"ok": True})
 
 
 @app.route("/api/settings", methods=["GET"])
@@ -191,9 +474,9 @@ def get_settings():
     doc = settings_col.find_one({"userId": user_id})
 
     if not doc:
-        return jsonify({"paycheck": 0, "savingsPercent": 0})
+        return Response(EMPTY_SETTINGS, mimetype="application/json")
 
-    return jsonify(
+    return ojson(
         {
             "paycheck": doc.get("paycheckCents", 0) / 100.0,
             "savingsPercent": doc.get("savingsPercent", 0),
@@ -201,5 +484,6 @@ def get_settings():
     )
 
 
+# Development server only; production runs under gunicorn (see gunicorn.conf.py)
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5050)
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+
+# Production server: gunicorn budget_buddy_project:app
+# Threaded workers let requests overlap while they wait on MongoDB.
+bind = os.environ.get("BIND", "0.0.0.0:5050")
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+threads = int(os.environ.get("THREADS", 16))